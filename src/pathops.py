@@ -31,8 +31,13 @@ with this program; if not, write to the Free Software Foundation, Inc.,
 # pylint: disable=too-many-ancestors
 
 # standard library
+from itertools import chain, islice
 import os
+import shutil
+import sys
 from subprocess import Popen, PIPE
+from tempfile import TemporaryFile
+from threading import Condition, Thread
 import time
 
 # local library
@@ -41,6 +46,7 @@ try:
 except ImportError:
     import inkex
 import simplestyle
+import simpletransform
 
 
 __version__ = '0.4'
@@ -48,6 +54,20 @@ __version__ = '0.4'
 
 # Global "constants"
 SVG_SHAPES = ('rect', 'circle', 'ellipse', 'line', 'polyline', 'polygon')
+# path ops which leave an object unchanged if it doesn't overlap the top one
+DISJOINT_NOOP_VERBS = ('SelectionDiff', 'SelectionDivide')
+
+# Namespaced tags and attributes, resolved once at import
+_NS_DEFS = inkex.addNS('defs', 'svg')
+_NS_G = inkex.addNS('g', 'svg')
+_NS_PATH = inkex.addNS('path', 'svg')
+_NS_SHAPES = frozenset(inkex.addNS(tag, 'svg') for tag in SVG_SHAPES)
+_NS_IMAGE = inkex.addNS('image', 'svg')
+_NS_TEXT = inkex.addNS('text', 'svg')
+_NS_TYPE = inkex.addNS('type', 'sodipodi')
+_NS_PE = inkex.addNS('path-effect', 'inkscape')
+_NS_HREF = inkex.addNS('href', 'xlink')
+_PATHOPS_TAGS = _NS_SHAPES | frozenset((_NS_PATH, _NS_TEXT))
 
 
 # ----- general helper functions
@@ -69,27 +89,27 @@ def get_defs(node):
     try:
         return node.xpath(path, namespaces=inkex.NSS)[0]
     except IndexError:
-        return inkex.etree.SubElement(node, inkex.addNS('defs', 'svg'))
+        return inkex.etree.SubElement(node, _NS_DEFS)
 
 
 def is_group(node):
     """Check node for group tag."""
-    return node.tag == inkex.addNS('g', 'svg')
+    return node.tag == _NS_G
 
 
 def is_path(node):
     """Check node for path tag."""
-    return node.tag == inkex.addNS('path', 'svg')
+    return node.tag == _NS_PATH
 
 
 def is_basic_shape(node):
     """Check node for SVG basic shape tag."""
-    return node.tag in (inkex.addNS(tag, 'svg') for tag in SVG_SHAPES)
+    return node.tag in _NS_SHAPES
 
 
 def is_custom_shape(node):
     """Check node for Inkscape custom shape type."""
-    return inkex.addNS('type', 'sodipodi') in node.attrib
+    return _NS_TYPE in node.attrib
 
 
 def is_shape(node):
@@ -99,7 +119,7 @@ def is_shape(node):
 
 def has_path_effect(node):
     """Check node for Inkscape path-effect attribute."""
-    return inkex.addNS('path-effect', 'inkscape') in node.attrib
+    return _NS_PE in node.attrib
 
 
 def is_modifiable_path(node):
@@ -110,63 +130,98 @@ def is_modifiable_path(node):
 
 def is_image(node):
     """Check node for image tag."""
-    return node.tag == inkex.addNS('image', 'svg')
+    return node.tag == _NS_IMAGE
 
 
 def is_text(node):
     """Check node for text tag."""
-    return node.tag == inkex.addNS('text', 'svg')
+    return node.tag == _NS_TEXT
 
 
 def does_pathops(node):
     """Check whether node is supported by Inkscape path operations."""
-    return (is_path(node) or
-            is_shape(node) or
-            is_text(node))
+    return node.tag in _PATHOPS_TAGS or _NS_TYPE in node.attrib
+
+
+def get_depth(node):
+    """Return count of ancestors of node."""
+    return sum(1 for _ in node.iterancestors())
+
+
+def is_collected(node, groups, level=0):
+    """Check whether node is a member collected with one of groups."""
+    if level == 1:
+        # members of a member group are not collected
+        return node.getparent() in groups and not is_group(node)
+    for parent in node.iterancestors():
+        if parent in groups:
+            return True
+        if not is_group(parent):
+            # only nested groups are walked
+            return False
+    return False
+
+
+def get_bbox(node):
+    """Return geometric bounding box of node in document coordinates."""
+    mat = [[1.0, 0.0, 0.0], [0.0, 1.0, 0.0]]
+    try:
+        for parent in node.iterancestors():
+            transform = parent.get('transform')
+            if transform:
+                mat = simpletransform.composeTransform(
+                    simpletransform.parseTransform(transform), mat)
+        return simpletransform.computeBBox([node], mat)
+    except Exception:  # pylint: disable=broad-except
+        # e.g. missing attributes, or lengths with units parsed as path data
+        return None
+
+
+def overlap(bbox_a, bbox_b):
+    """Check whether two bounding boxes (xmin, xmax, ymin, ymax) overlap."""
+    return (bbox_a[0] <= bbox_b[1] and bbox_b[0] <= bbox_a[1] and
+            bbox_a[2] <= bbox_b[3] and bbox_b[2] <= bbox_a[3])
 
 
 # ----- list processing helper functions
 
-def z_sort(node, alist):
-    """Return new list sorted in document order (depth-first traversal)."""
-    ordered = []
-    id_list = list(alist)
-    count = len(id_list)
-    for element in node.iter():
-        element_id = element.get('id')
-        if element_id is not None and element_id in id_list:
-            id_list.remove(element_id)
-            ordered.append(element_id)
-            count -= 1
-            if not count:
-                break
-    return ordered
-
-
-def z_iter(node, alist):
-    """Return iterator over ids in document order (depth-first traversal)."""
-    id_list = list(alist)
-    for element in node.iter():
-        element_id = element.get('id')
-        if element_id is not None and element_id in id_list:
-            id_list.remove(element_id)
-            yield element_id
+def split_zorder(ids, z_index):
+    """Return ids in document order without top-most one, and top-most id."""
+    ordered = sorted(ids, key=z_index.get)
+    top_id = ordered.pop()
+    return ordered, top_id
 
 
 def chunks(alist, max_len):
-    """Chunk a list into sublists of max_len length."""
-    for i in range(0, len(alist), max_len):
-        yield alist[i:i+max_len]
+    """Chunk a list (or any iterable) into sublists of max_len length."""
+    items = iter(alist)
+    while True:
+        chunk = list(islice(items, max_len))
+        if not chunk:
+            return
+        yield chunk
 
 
 # ----- process external command, files
 
+def which(cmd):
+    """Return absolute path of executable cmd if found, else cmd."""
+    find = getattr(shutil, 'which', None)  # python >= 3.3
+    return (find(cmd) if find is not None else None) or cmd
+
+
+# resolved once: python >= 3.8 spawns with posix_spawn() instead of
+# fork() + exec() only for an executable with directory, and with
+# close_fds=False
+INKSCAPE = which('inkscape')
+
+
 def run(cmd_format, stdin_str=None, verbose=False):
     """Run command"""
     if verbose:
         inkex.debug(cmd_format)
     out = err = None
-    myproc = Popen(cmd_format, shell=False,
+    myproc = Popen(cmd_format, shell=False, close_fds=False,
                    stdin=PIPE, stdout=PIPE, stderr=PIPE)
     out, err = myproc.communicate(stdin_str)
     if myproc.returncode == 0:
@@ -177,19 +232,17 @@ def run(cmd_format, stdin_str=None, verbose=False):
 
 def run_pathops(svgfile, top_path, id_list, ink_verb, dry_run=False):
     """Run path ops with top_path on a list of other object ids."""
+    # constant arguments, used for each object id
+    sel_top = "--select=" + top_path
+    verb_dup = "--verb=EditDuplicate"
+    verb_op = "--verb=" + ink_verb
+    verb_desel = "--verb=EditDeselect"
     # build list with command line arguments
-    cmdlist = []
-    cmdlist.append("inkscape")
-    for node_id in id_list:
-        cmdlist.append("--select=" + top_path)
-        cmdlist.append("--verb=EditDuplicate")
-        cmdlist.append("--select=" + node_id)
-        cmdlist.append("--verb=" + ink_verb)
-        cmdlist.append("--verb=EditDeselect")
-    cmdlist.append("--verb=FileSave")
-    cmdlist.append("--verb=FileQuit")
-    cmdlist.append("-f")
-    cmdlist.append(svgfile)
+    cmdlist = [INKSCAPE]
+    cmdlist.extend(chain.from_iterable(
+        (sel_top, verb_dup, "--select=" + node_id, verb_op, verb_desel)
+        for node_id in id_list))
+    cmdlist.extend(("--verb=FileSave", "--verb=FileQuit", "-f", svgfile))
     # process command list
     if dry_run:
         inkex.debug(cmdlist)
@@ -197,6 +250,165 @@ def run_pathops(svgfile, top_path, id_list, ink_verb, dry_run=False):
         run(cmdlist)
 
 
+class InkscapeShell(object):
+    """Persistent Inkscape shell session to process a single document."""
+
+    prompt = b'> '
+    # smallest common pipe buffer size
+    pipe_size = 4096
+    # inkscape 0.92 has no shell actions, inkscape >= 1.2 has no verbs
+    actions = ('file-open', 'select-by-id', 'verb')
+
+    def __init__(self, svgfile, verbose=False):
+        """Start inkscape in shell mode, open svgfile."""
+        self.verbose = verbose
+        # stderr is spooled to a file: an unread pipe could fill up with
+        # warnings and block the session
+        self.errors = TemporaryFile()
+        self.proc = Popen([INKSCAPE, '--shell'], shell=False, bufsize=0,
+                          close_fds=False,
+                          stdin=PIPE, stdout=PIPE, stderr=self.errors)
+        # stdout is drained by a reader thread: inkscape must never block
+        # on a full stdout pipe while a chunk is written to its stdin
+        self.output = bytearray()
+        self.prompts = 0
+        # count of prompts expected so far (including the initial one)
+        self.expected = 1
+        self.eof = False
+        self.cond = Condition()
+        self.reader = Thread(target=self.read_output)
+        self.reader.daemon = True
+        self.reader.start()
+        # set if inkscape quit before the end of the session
+        self.failed = False
+        self.missing = self.missing_actions()
+        if not self.missing:
+            self.send('file-open:' + svgfile)
+
+    def missing_actions(self):
+        """Return actions not listed by the shell session."""
+        listed = set()
+        out = self.send('action-list').decode('utf-8', 'replace')
+        for line in out.splitlines():
+            name = line.split(':', 1)[0].strip()
+            if name.startswith('app.'):
+                name = name[4:]
+            listed.add(name)
+        return [name for name in self.actions if name not in listed]
+
+    def read_output(self):
+        """Collect output of shell session, count prompts (reader thread)."""
+        stdout = self.proc.stdout.fileno()
+        tail = b''
+        while True:
+            try:
+                data = os.read(stdout, 4096)
+            except (IOError, OSError):
+                data = b''
+            with self.cond:
+                if not data:
+                    self.eof = True
+                    self.cond.notify_all()
+                    return
+                self.output += data
+                # a prompt may be split across reads
+                data = tail + data
+                self.prompts += data.count(self.prompt)
+                tail = data[1 - len(self.prompt):]
+                self.cond.notify_all()
+
+    def write(self, cmdlist):
+        """Send command lines to shell session, don't wait for prompts."""
+        if self.failed:
+            return
+        if self.verbose:
+            inkex.debug(cmdlist)
+        with self.cond:
+            self.expected += len(cmdlist)
+        # whole transcript in one buffer, written in pieces no larger than
+        # a pipe buffer while the reader thread drains stdout
+        buf = ''.join(cmdstr + '\n' for cmdstr in cmdlist).encode('utf-8')
+        buf = memoryview(buf)
+        stdin = self.proc.stdin.fileno()
+        try:
+            while buf and not self.eof:
+                buf = buf[os.write(stdin, buf[:self.pipe_size]):]
+        except (IOError, OSError):
+            # inkscape has quit (broken pipe), reported in close()
+            self.failed = True
+
+    def wait(self, keep=0):
+        """Wait for shell session output until at most keep prompts remain."""
+        with self.cond:
+            while self.expected - self.prompts > keep and not self.eof:
+                self.cond.wait()
+            if self.expected - self.prompts > keep:
+                # inkscape has quit, reported in close()
+                self.failed = True
+            out = bytes(self.output)
+            del self.output[:]
+        if self.verbose:
+            inkex.debug(out)
+        return out
+
+    def send(self, cmdstr):
+        """Send command line to shell session, wait for all prompts."""
+        self.write([cmdstr])
+        return self.wait()
+
+    def close(self):
+        """Quit shell session, report errors."""
+        try:
+            self.proc.stdin.write(b'quit\n')
+            self.proc.stdin.close()
+        except (IOError, OSError):
+            self.failed = True
+        self.proc.wait()
+        self.reader.join()
+        if self.failed or self.proc.returncode != 0:
+            self.failed = True
+            self.errors.seek(0)
+            inkex.errormsg("Inkscape shell session failed.")
+            inkex.errormsg(self.errors.read().decode('utf-8', 'replace'))
+        self.errors.close()
+
+
+def shell_pathops(session, top_path, id_list, ink_verb, dry_run=False):
+    """Run path ops with top_path on a list of other object ids."""
+    # one line of chained actions per object id
+    head = "select-by-id:{};verb:EditDuplicate;select-by-id:".format(top_path)
+    tail = ";verb:{};verb:EditDeselect".format(ink_verb)
+    # build list with shell commands
+    cmdlist = [head + node_id + tail for node_id in id_list]
+    # process command list
+    if dry_run:
+        inkex.debug(cmdlist)
+    else:
+        # queue this chunk while inkscape is still busy with the previous
+        # one, then only wait for the prompts of the previous chunk
+        session.write(cmdlist)
+        session.wait(keep=len(cmdlist))
+
+
+def copy_file(src, dst):
+    """Copy file content, within the kernel if supported (reflink)."""
+    copy_range = getattr(os, 'copy_file_range', None)  # python >= 3.8
+    if copy_range is not None:
+        try:
+            with open(src, 'rb') as fsrc, open(dst, 'wb') as fdst:
+                size = os.fstat(fsrc.fileno()).st_size
+                while size > 0:
+                    sent = copy_range(fsrc.fileno(), fdst.fileno(), size)
+                    if not sent:
+                        break
+                    size -= sent
+            if size <= 0:
+                return
+        except OSError:
+            pass
+    shutil.copyfile(src, dst)
+
+
 def cleanup(tempfile):
     """Clean up tempfile."""
     try:
@@ -214,6 +426,13 @@ class PathOps(inkex.Effect):
         """Init base class."""
         inkex.Effect.__init__(self)
 
+        # whether the parsed document differs from the input file
+        self.modified = False
+        # document order of element ids (see collect_ids())
+        self.z_index = {}
+        # processed temp copy to be written unparsed (see output())
+        self.result_file = None
+
         # options
         self.OptionParser.add_option("--ink_verb",
                                      action="store", type="string",
@@ -223,6 +442,14 @@ class PathOps(inkex.Effect):
                                      action="store", type="int",
                                      dest="max_ops", default=500,
                                      help="Max ops per external run")
+        self.OptionParser.add_option("--shell_mode",
+                                     action="store", type="inkbool",
+                                     dest="shell_mode", default=False,
+                                     help="Use a single inkscape shell")
+        self.OptionParser.add_option("--skip_disjoint",
+                                     action="store", type="inkbool",
+                                     dest="skip_disjoint", default=True,
+                                     help="Skip objects outside top bbox")
         self.OptionParser.add_option("--recursive_sel",
                                      action="store", type="inkbool",
                                      dest="recursive_sel", default=True,
@@ -249,6 +476,7 @@ class PathOps(inkex.Effect):
         """Update checked property."""
         if not self.options.dry_run:
             node.attrib[prop] = val
+            self.modified = True
 
     def check_props(self, node):
         """Check properties and modify as needed based on options."""
@@ -269,49 +497,103 @@ class PathOps(inkex.Effect):
                 sdict[prop] = stroke_width
             self.update_attrib(node, 'style', simplestyle.formatStyle(sdict))
 
-    def recurse_selection(self, node, id_list, level=0, current=0):
-        """Recursively process selection, add checked elements to id list."""
-        current += 1
-        if not level or current <= level:
-            if is_group(node):
-                for child in node:
-                    id_list = self.recurse_selection(
-                        child, id_list, level, current)
+    def collect_selection(self, node, id_set, level=0):
+        """Process selected node, add checked elements to id set."""
+        if is_group(node):
+            # walk nested groups with a stack instead of recursion, let
+            # lxml match the tags in C (custom shapes are paths too)
+            groups = [node]
+            while groups:
+                group = groups.pop()
+                try:
+                    members = group.iterchildren(_NS_G, *_PATHOPS_TAGS)
+                except TypeError:
+                    # fallback for lxml < 3.0
+                    members = (child for child in group
+                               if is_group(child) or does_pathops(child))
+                for child in members:
+                    if is_group(child):
+                        if level != 1:
+                            groups.append(child)
+                        if not is_custom_shape(child):
+                            continue
+                    self.check_props(child)
+                    id_set.add(child.get('id'))
         if does_pathops(node):
             self.check_props(node)
-            id_list.append(node.get('id'))
-        return id_list
+            id_set.add(node.get('id'))
+        return id_set
+
+    def write_tempfile(self, tempfile):
+        """Copy input file to tempfile, or write modified document."""
+        if not self.modified:
+            try:
+                copy_file(self.svg_file, tempfile)
+                return
+            except (IOError, OSError):
+                pass
+        with open(tempfile, 'wb') as copycat:
+            self.document.write(copycat)
 
     def get_selected_ids(self):
-        """Return a list of valid ids for inkscape path operations."""
-        id_list = []
+        """Return a set of valid ids for inkscape path operations."""
+        id_set = set()
         if not len(self.selected):
             pass
         else:
             # level = 0: unlimited recursion into groups
             # level = 1: process top-level groups only
             level = 0 if self.options.recursive_sel else 1
-            for node in self.selected.values():
-                self.recurse_selection(node, id_list, level)
-        if len(id_list) < 2:
+            # outer nodes first, to skip selected nodes already collected
+            # as members of a selected group
+            scheduled = set()
+            for node in sorted(self.selected.values(), key=get_depth):
+                if not is_collected(node, scheduled, level):
+                    if is_group(node):
+                        scheduled.add(node)
+                    self.collect_selection(node, id_set, level)
+            id_set.discard(None)
+        if len(id_set) < 2:
             inkex.errormsg("This extension requires at least 2 elements "
                            "of type path, shape or text. "
                            "The elements can be part of selected groups, "
                            "or directly selected.")
             return None
         else:
-            return id_list
+            return id_set
 
     def get_sorted_ids(self):
         """Return id of top-most object, and a list with z-sorted ids."""
         top_path = None
         sorted_ids = None
-        id_list = self.get_selected_ids()
-        if id_list is not None:
-            sorted_ids = list(z_iter(self.document.getroot(), id_list))
-            top_path = sorted_ids.pop()
+        id_set = self.get_selected_ids()
+        if id_set is not None:
+            # document order is known from the initial walk in collect_ids()
+            sorted_ids, top_path = split_zorder(id_set, self.z_index)
         return (top_path, sorted_ids)
 
+    def drop_disjoint(self, top_path, other_paths):
+        """Return list without paths not overlapping the top object."""
+        top_bbox = get_bbox(self.getElementById(top_path))
+        if top_bbox is None:
+            return other_paths
+        disjoint = set()
+        pending = set(other_paths)
+        for node in self.document.getroot().iter():
+            node_id = node.get('id')
+            if node_id in pending:
+                pending.discard(node_id)
+                # shapes and paths with path effect are converted to plain
+                # paths by inkscape, even if unchanged otherwise
+                if is_modifiable_path(node):
+                    bbox = get_bbox(node)
+                    if bbox is not None and not overlap(top_bbox, bbox):
+                        disjoint.add(node_id)
+                if not pending:
+                    break
+        return [node_id for node_id in other_paths
+                if node_id not in disjoint]
+
     def loop_pathops(self, top_path, other_paths):
         """Loop through selected items and run external command(s)."""
         # init variables
@@ -319,34 +601,64 @@ class PathOps(inkex.Effect):
         max_ops = self.options.max_ops or 500
         ink_verb = self.options.ink_verb or "SelectionDiff"
         dry_run = self.options.dry_run
+        shell_mode = self.options.shell_mode
+        session = None
         tempfile = os.path.splitext(self.svg_file)[0] + "-pathops.svg"
         # prepare
+        if self.options.skip_disjoint and ink_verb in DISJOINT_NOOP_VERBS:
+            total = len(other_paths)
+            other_paths = self.drop_disjoint(top_path, other_paths)
+            if dry_run:
+                inkex.debug("# Disjoint objects skipped: {}".format(
+                    total - len(other_paths)))
         if dry_run:
             inkex.debug("# Top object id: {}".format(top_path))
             inkex.debug("# Other objects total: {}".format(len(other_paths)))
         else:
-            with open(tempfile, 'wb') as copycat:
-                self.document.write(copycat)
+            self.write_tempfile(tempfile)
+            if shell_mode:
+                session = InkscapeShell(tempfile)
+                if session.missing:
+                    inkex.errormsg(
+                        "This Inkscape version does not support the shell "
+                        "actions: {}. ".format(", ".join(session.missing)) +
+                        "Running a separate command per chunk instead.")
+                    session.close()
+                    session = None
+                    shell_mode = False
         # loop through sorted id list, process in chunks
         for chunk in chunks(other_paths, max_ops):
             count += 1
             if dry_run:
                 inkex.debug("\n# Processing {}. chunk ".format(count) +
                             "with {} objects ...".format(len(chunk)))
-            run_pathops(tempfile, top_path, chunk, ink_verb, dry_run)
+            if shell_mode:
+                shell_pathops(session, top_path, chunk, ink_verb, dry_run)
+            else:
+                run_pathops(tempfile, top_path, chunk, ink_verb, dry_run)
         # finish up
+        if session is not None:
+            session.send("verb:FileSave")
+            session.close()
+            if session.failed:
+                # keep current document
+                cleanup(tempfile)
+                return
         if dry_run:
             inkex.debug("\n# {} chunks processed, ".format(count) +
                         "with {} total objects.".format(len(other_paths)))
+        elif self.options.keep_top:
+            # no further changes: the temp copy is passed on as is
+            # (effect() bails out early if the document has tagrefs)
+            self.result_file = tempfile
         else:
             # replace current document with content of temp copy
             xmlparser = inkex.etree.XMLParser(huge_tree=True)
             self.document = inkex.etree.parse(tempfile, parser=xmlparser)
-            # optionally delete top-most element when done
-            if not self.options.keep_top:
-                top_node = self.getElementById(top_path)
-                if top_node is not None:
-                    top_node.getparent().remove(top_node)
+            # delete top-most element when done
+            top_node = self.getElementById(top_path)
+            if top_node is not None:
+                top_node.getparent().remove(top_node)
             # purge missing tagrefs (see below)
             self.update_tagrefs()
             # clean up
@@ -412,12 +724,12 @@ class PathOps(inkex.Effect):
         inkscape_tagrefs = self.get_tagrefs(defs)
         if len(inkscape_tagrefs):
             for tagref in inkscape_tagrefs:
-                href = tagref.get(inkex.addNS('href', 'xlink'))[1:]
+                href = tagref.get(_NS_HREF)[1:]
                 if self.getElementById(href) is None:
                     if mode == 'purge':
                         tagref.getparent().remove(tagref)
                     elif mode == 'placeholder':
-                        temp = inkex.etree.Element(inkex.addNS('path', 'svg'))
+                        temp = inkex.etree.Element(_NS_PATH)
                         temp.set('id', href)
                         temp.set('d', 'M 0,0 Z')
                         self.document.getroot().append(temp)
@@ -425,16 +737,20 @@ class PathOps(inkex.Effect):
     # ----- workaround to fix Effect() performance with large selections
 
     def collect_ids(self, doc=None):
-        """Iterate all elements, build id dicts (doc_ids, selected)."""
+        """Iterate all elements, build doc_ids, selected and z_index."""
         doc = self.document if doc is None else doc
-        id_list = list(self.options.ids)
-        for node in doc.getroot().iter(tag=inkex.etree.Element):
-            if 'id' in node.attrib:
-                node_id = node.get('id')
+        pending = set(self.options.ids)
+        elements = doc.getroot().iter(tag=inkex.etree.Element)
+        for index, node in enumerate(elements):
+            # one attribute lookup per element: node.get() is faster than
+            # a membership test on node.attrib (a new proxy object per node)
+            node_id = node.get('id')
+            if node_id is not None:
                 self.doc_ids[node_id] = 1
-                if node_id in id_list:
+                self.z_index[node_id] = index
+                if node_id in pending:
                     self.selected[node_id] = node
-                    id_list.remove(node_id)
+                    pending.discard(node_id)
 
     def getselected(self):
         """Overload Effect() method."""
@@ -444,6 +760,16 @@ class PathOps(inkex.Effect):
         """Overload Effect() method."""
         pass
 
+    def output(self):
+        """Overload Effect() method."""
+        if self.result_file is None:
+            inkex.Effect.output(self)
+        else:
+            stdout = getattr(sys.stdout, 'buffer', sys.stdout)
+            with open(self.result_file, 'rb') as result:
+                shutil.copyfileobj(result, stdout)
+            cleanup(self.result_file)
+
 
 if __name__ == '__main__':
     ME = PathOps()